@@ -4,10 +4,15 @@ import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import json
 from datetime import datetime
+from typing import Optional, Tuple
 import os
 from google.oauth2 import service_account
 from google.cloud import bigquery
+from google.cloud import bigquery_storage
 from dotenv import load_dotenv
 
 # 🎨 Importar estilos
@@ -26,14 +31,14 @@ st.set_page_config(
 # -----------------------------
 # Helpers de formato
 # -----------------------------
+# Separadores en formato español: intercambia "." y "," en una sola pasada
+_ES_TRANS = str.maketrans({".": ",", ",": "."})
+
 def format_number(num):
     if pd.isna(num):
         return "N/A"
     if isinstance(num, (int, float, np.floating, np.integer)):
-        if num >= 1000:
-            return f"{num:,.1f}".replace(",", "X").replace(".", ",").replace("X", ".")
-        else:
-            return f"{num:.1f}".replace(".", ",")
+        return format(num, ",.1f" if num >= 1000 else ".1f").translate(_ES_TRANS)
     return str(num)
 
 def format_kg(num):
@@ -53,14 +58,16 @@ def format_count(num):
 # -----------------------------
 # Credenciales BigQuery (con secrets)
 # -----------------------------
+def get_credentials():
+    return service_account.Credentials.from_service_account_info(
+        st.secrets["gcp_service_account"]
+    )
+
 def get_bq_client():
     """Devuelve un cliente de BigQuery usando st.secrets (funciona igual en local y en Cloud)."""
     try:
-        creds = service_account.Credentials.from_service_account_info(
-            st.secrets["gcp_service_account"]
-        )
         client = bigquery.Client(
-            credentials=creds,
+            credentials=get_credentials(),
             project=st.secrets["general"]["PROJECT_ID"]
         )
         return client, st.secrets["general"]["DATASET_ID"]
@@ -68,48 +75,515 @@ def get_bq_client():
         st.error(f"❌ Error al crear cliente de BigQuery: {e}")
         return None, None
 
+@st.cache_resource
+def get_bqstorage_client():
+    """Cliente de la BigQuery Storage API (lectura vía gRPC/Arrow), reutilizado entre reruns."""
+    return bigquery_storage.BigQueryReadClient(credentials=get_credentials())
+
 # -----------------------------
-# Carga de datos desde BigQuery
+# Invalidación de cachés cuando cambia results_clean
 # -----------------------------
-@st.cache_data
-def load_data(sample: bool = True):
+@st.cache_data(ttl=60, show_spinner=False)
+def dataset_version():
+    """Última modificación de results_clean según BigQuery (None si no se puede consultar)."""
     client, dataset_id = get_bq_client()
     if not client:
-        return pd.DataFrame()
+        return None
+    try:
+        return client.get_table(f"{client.project}.{dataset_id}.results_clean").modified
+    except Exception:
+        return None
+
+@st.cache_resource
+def loaded_version():
+    """Versión de results_clean con la que se llenaron las cachés (compartida entre sesiones)."""
+    return {"modified": None}
+
+def refresh_caches_if_stale():
+    """Vacía las cachés si la tabla cambió desde la última carga; si no, las deja vivir hasta su ttl."""
+    current = dataset_version()
+    if current is None:
+        # Fallo transitorio de get_table: se conserva la versión conocida
+        return
+    seen = loaded_version()
+    if seen["modified"] not in (None, current):
+        st.cache_data.clear()
+        st.cache_resource.clear()
+        seen = loaded_version()
+    seen["modified"] = current
+
+# -----------------------------
+# Consultas parametrizadas a BigQuery
+# -----------------------------
+# 🚀 Cambiar a False para full dataset
+SAMPLE = True
+SAMPLE_LIMIT = 10000
+# ⚠️ ajustar al total real de BigQuery; el texto se formatea una sola vez
+TOTAL_ORIGINAL = 2463024
+TOTAL_ORIGINAL_FMT = f"{TOTAL_ORIGINAL:,}".replace(",", ".")
+
+LIFT_COLS = ["Best3SquatKg", "Best3BenchKg", "Best3DeadliftKg", "TotalKg"]
+FLOAT_COLS = LIFT_COLS + ["BodyweightKg", "Dots"]
+CATEGORY_COLS = ["Sex", "Equipment", "Country", "AgeClass", "WeightClass", "NameNormalized"]
+# Columnas que trae load_data; Date llega ya como DATETIME → timestamp de Arrow
+USED_COLS = ["NameNormalized", "Sex", "Equipment", "Country", "Year",
+             "CAST(Date AS DATETIME) AS Date", "AgeClass", "WeightClass",
+             "BodyweightKg"] + LIFT_COLS + ["Dots"]
+
+# Por encima de este número de puntos los scatter se agregan en un heatmap de densidad
+SCATTER_MAX_POINTS = 20_000
+# Filas máximas enviadas al navegador en la tabla de competencias del atleta
+ATHLETE_TABLE_MAX_ROWS = 200
+
+# Firma de los filtros del sidebar: (sex, equip, country, age, year_min, year_max, total_min, total_max).
+# Es la clave de todos los loaders cacheados: hashearla cuesta nanosegundos, a diferencia de un DataFrame.
+FilterKey = Tuple[str, str, str, str, int, int, float, float]
+# Combinaciones de filtros que cada loader recuerda; acota la memoria de la caché
+CACHE_MAX_ENTRIES = 32
+
+def make_filter_key(sex, equip, country, age, year_range, total_range) -> FilterKey:
+    return (sex, equip, country, age,
+            int(year_range[0]), int(year_range[1]),
+            float(total_range[0]), float(total_range[1]))
+
+def build_filters(key: Optional[FilterKey] = None):
+    """Compone el WHERE y sus parámetros; sin clave solo aplica la condición base."""
+    conditions = ["Year >= 2000"]
+    params = []
+    if key is None:
+        return " AND ".join(conditions), params
+    sex, equip, country, age, year_min, year_max, total_min, total_max = key
+    for col, value in [("Sex", sex), ("Equipment", equip), ("Country", country), ("AgeClass", age)]:
+        if value != "Todos":
+            conditions.append(f"{col} = @{col.lower()}")
+            params.append(bigquery.ScalarQueryParameter(col.lower(), "STRING", value))
+    conditions.append("Year BETWEEN @year_min AND @year_max")
+    conditions.append("TotalKg BETWEEN @total_min AND @total_max")
+    params += [bigquery.ScalarQueryParameter("year_min", "INT64", year_min),
+               bigquery.ScalarQueryParameter("year_max", "INT64", year_max),
+               bigquery.ScalarQueryParameter("total_min", "FLOAT64", total_min),
+               bigquery.ScalarQueryParameter("total_max", "FLOAT64", total_max)]
+    return " AND ".join(conditions), params
+
+def run_arrow_query(query, params=None):
+    """Ejecuta `query` (con `{table}` como marcador de results_clean) y devuelve una pa.Table."""
+    client, dataset_id = get_bq_client()
+    if not client:
+        return pa.table({})
     try:
-        query = f"""
-            SELECT 
-                NameNormalized, Sex, Equipment, Country, Year, Date, AgeClass,
-                WeightClass, BodyweightKg, Federation,
-                Best3SquatKg, Best3BenchKg, Best3DeadliftKg, TotalKg,
-                Wilks, Dots, Glossbrenner, Goodlift,
-                Squat1Kg,Squat2Kg,Squat3Kg,
-                Bench1Kg,Bench2Kg,Bench3Kg,
-                Deadlift1Kg,Deadlift2Kg,Deadlift3Kg
-            FROM `{client.project}.{dataset_id}.results_clean`
-            WHERE Year >= 2000
-        """
-        if sample:
-            query += " LIMIT 10000"
-        df = client.query(query).to_dataframe(create_bqstorage_client=False)
-        if "Date" in df.columns:
-            df["Date"] = pd.to_datetime(df["Date"], errors="coerce")
-        return df
+        job_config = bigquery.QueryJobConfig(query_parameters=params or [])
+        table = f"`{client.project}.{dataset_id}.results_clean`"
+        rows = client.query(query.format(table=table), job_config=job_config).result()
+        return rows.to_arrow(bqstorage_client=get_bqstorage_client(), progress_bar_type=None)
     except Exception as e:
         st.error(f"❌ Error al cargar datos desde BigQuery: {e}")
+        return pa.table({})
+
+def run_query(query, params=None):
+    """Como run_arrow_query, pero devuelve un DataFrame."""
+    arrow = run_arrow_query(query, params)
+    return arrow.to_pandas(split_blocks=True, self_destruct=True, date_as_object=False)
+
+def sorted_dictionary(col):
+    """Codifica `col` como diccionario con categorías ordenadas, igual que astype("category")."""
+    values = pc.unique(col).drop_null()
+    values = values.take(pc.sort_indices(values))
+    # Índices del entero más pequeño que alcance, como los códigos de pandas
+    index_type = next(t for t in (pa.int8(), pa.int16(), pa.int32()) if len(values) < 2 ** (t.bit_width - 1))
+    indices = pc.index_in(col, value_set=values).combine_chunks().cast(index_type)
+    return pa.DictionaryArray.from_arrays(indices, values)
+
+def table_categories(tbl, col):
+    """Categorías ordenadas de una columna codificada con sorted_dictionary."""
+    return tbl[col].chunk(0).dictionary.to_pylist()
+
+@st.cache_data(ttl=3600)
+def load_filter_options():
+    """Valores distintos y rangos para el sidebar, sin traer la tabla completa."""
+    where, params = build_filters()
+    opts = run_query(f"""
+        SELECT
+            ARRAY_AGG(DISTINCT Sex IGNORE NULLS ORDER BY Sex) AS Sex,
+            ARRAY_AGG(DISTINCT Equipment IGNORE NULLS ORDER BY Equipment) AS Equipment,
+            ARRAY_AGG(DISTINCT Country IGNORE NULLS ORDER BY Country) AS Country,
+            ARRAY_AGG(DISTINCT AgeClass IGNORE NULLS ORDER BY AgeClass) AS AgeClass,
+            MIN(Year) AS year_min, MAX(Year) AS year_max,
+            MIN(TotalKg) AS total_min, MAX(TotalKg) AS total_max
+        FROM {{table}}
+        WHERE {where}
+    """, params)
+    if opts.empty:
+        return None
+    row = opts.iloc[0]
+    return {
+        **{c: list(row[c]) for c in ["Sex", "Equipment", "Country", "AgeClass"]},
+        "year": (int(row["year_min"]), int(row["year_max"])),
+        "total": (float(row["total_min"]), float(row["total_max"])),
+    }
+
+@st.cache_resource(ttl=3600, max_entries=CACHE_MAX_ENTRIES)
+def load_table(key: Optional[FilterKey], sample=SAMPLE):
+    """Filas de results_clean para `key` (o el dataset base si es None) como pa.Table compartida."""
+    where, params = build_filters(key)
+    query = f"""
+        SELECT {", ".join(USED_COLS)}
+        FROM {{table}}
+        WHERE {where}
+    """
+    if sample:
+        query += f" LIMIT {SAMPLE_LIMIT}"
+    tbl = run_arrow_query(query, params)
+    if tbl.num_rows == 0:
+        return tbl
+    # Tipos compactos en Arrow: en pandas llegan como int16, float32 y categóricas
+    for i, name in enumerate(tbl.column_names):
+        if name == "Year":
+            tbl = tbl.set_column(i, name, tbl[name].cast(pa.int16()))
+        elif name in FLOAT_COLS:
+            tbl = tbl.set_column(i, name, tbl[name].cast(pa.float32()))
+        elif name in CATEGORY_COLS:
+            tbl = tbl.set_column(i, name, sorted_dictionary(tbl[name]))
+    return tbl
+
+def load_data(key: Optional[FilterKey] = None, cols=None):
+    """Vista pandas de load_table(key), solo con las columnas `cols` si se indican."""
+    tbl = load_table(key)
+    if tbl.num_rows == 0:
         return pd.DataFrame()
+    if cols is not None:
+        tbl = tbl.select(cols)
+    # Sin self_destruct: la tabla está cacheada y la comparten todas las sesiones
+    return tbl.to_pandas(split_blocks=True, date_as_object=False)
+
+@st.cache_data(ttl=3600, max_entries=CACHE_MAX_ENTRIES)
+def load_attempts(name):
+    """Intentos individuales (Squat1Kg..Deadlift3Kg) de un solo atleta, bajo demanda."""
+    return run_query("""
+        SELECT 
+            CAST(Date AS DATETIME) AS Date,
+            Squat1Kg,Squat2Kg,Squat3Kg,
+            Bench1Kg,Bench2Kg,Bench3Kg,
+            Deadlift1Kg,Deadlift2Kg,Deadlift3Kg
+        FROM {table}
+        WHERE NameNormalized = @name
+        ORDER BY Date
+    """, [bigquery.ScalarQueryParameter("name", "STRING", name)])
 
+# -----------------------------
+# Agregados de Información General
+# -----------------------------
+# Con SAMPLE, un LIMIT sin ORDER BY no garantiza qué filas devuelve BigQuery: los
+# agregados salen de la misma muestra cacheada de load_table(key) que el resto de
+# gráficos. Sin muestra se agregan en BigQuery sobre todas las filas filtradas.
+@st.cache_data(ttl=3600, max_entries=CACHE_MAX_ENTRIES)
+def load_participation(key: FilterKey):
+    if SAMPLE:
+        df = load_data(key, ["Year", "NameNormalized", "TotalKg"])
+        if df.empty:
+            return df
+        return df.groupby("Year").agg(
+            NameNormalized=("NameNormalized", "nunique"),
+            TotalKg=("TotalKg", "mean"),
+        ).reset_index()
+    where, params = build_filters(key)
+    return run_query(f"""
+        SELECT Year, COUNT(DISTINCT NameNormalized) AS NameNormalized, AVG(TotalKg) AS TotalKg
+        FROM {{table}}
+        WHERE {where}
+        GROUP BY Year
+        ORDER BY Year
+    """, params)
+
+@st.cache_data(ttl=3600, max_entries=CACHE_MAX_ENTRIES)
+def load_sex_evolution(key: FilterKey):
+    if SAMPLE:
+        df = load_data(key, ["Year", "Sex"])
+        if df.empty:
+            return df
+        return df.groupby(["Year", "Sex"], observed=True).size().reset_index(name="Competencias")
+    where, params = build_filters(key)
+    return run_query(f"""
+        SELECT Year, Sex, COUNT(*) AS Competencias
+        FROM {{table}}
+        WHERE {where} AND Sex IS NOT NULL
+        GROUP BY Year, Sex
+        ORDER BY Year, Sex
+    """, params)
+
+@st.cache_data(ttl=3600, max_entries=CACHE_MAX_ENTRIES)
+def load_lift_evolution(key: FilterKey):
+    """Promedio anual de S/B/D por sexo y general (Sex="Promedio") en una sola pasada."""
+    lifts = LIFT_COLS[:3]
+    if SAMPLE:
+        df = load_data(key, ["Year", "Sex"] + lifts)
+        if df.empty:
+            return df
+        per_sex = df.groupby(["Year", "Sex"], observed=True)[lifts].mean().reset_index()
+        avg = df.groupby("Year")[lifts].mean().reset_index().assign(Sex="Promedio")
+        # Orden estable por año: primero cada sexo, luego el promedio (como el ORDER BY de abajo)
+        evol = pd.concat([per_sex.astype({"Sex": object}), avg[per_sex.columns]], ignore_index=True)
+        return evol.sort_values("Year", kind="stable", ignore_index=True)
+    where, params = build_filters(key)
+    evol = run_query(f"""
+        SELECT
+            Year, Sex, GROUPING(Sex) AS es_promedio,
+            AVG(Best3SquatKg) AS Best3SquatKg,
+            AVG(Best3BenchKg) AS Best3BenchKg,
+            AVG(Best3DeadliftKg) AS Best3DeadliftKg
+        FROM {{table}}
+        WHERE {where}
+        GROUP BY ROLLUP(Year, Sex)
+        HAVING GROUPING(Year) = 0 AND (GROUPING(Sex) = 1 OR Sex IS NOT NULL)
+        ORDER BY Year, es_promedio, Sex
+    """, params)
+    if evol.empty:
+        return evol
+    evol.loc[evol["es_promedio"] == 1, "Sex"] = "Promedio"
+    return evol.drop(columns="es_promedio")
 
-# 🚀 Cambiar a False para full dataset
-df = load_data(sample=True)
-if df.empty:
+
+# -----------------------------
+# Agregados cacheados sobre la muestra filtrada
+# -----------------------------
+@st.cache_data(ttl=3600, max_entries=CACHE_MAX_ENTRIES)
+def agg_counts(key: FilterKey, col):
+    return load_data(key, [col])[col].value_counts().reset_index()
+
+@st.cache_data(ttl=3600, max_entries=CACHE_MAX_ENTRIES)
+def agg_geo(key: FilterKey):
+    filtered = load_data(key, ["Country", "Sex", "AgeClass", "NameNormalized", "Dots"] + LIFT_COLS)
+    # Edad numérica: se parsean solo las categorías y se indexa con los códigos
+    ages = filtered["AgeClass"].cat
+    age_num = np.append(pd.to_numeric(ages.categories, errors="coerce"), np.nan)[ages.codes.to_numpy()]
+    geo_df = filtered.assign(AgeNum=age_num).groupby("Country", observed=True).agg(
+        atletas_totales=("NameNormalized","nunique"),
+        promedio_total=("TotalKg","mean"),
+        promedio_squat=("Best3SquatKg","mean"),
+        promedio_bench=("Best3BenchKg","mean"),
+        promedio_deadlift=("Best3DeadliftKg","mean"),
+        promedio_dots=("Dots","mean"),
+        promedio_edad=("AgeNum","mean")
+    )
+    # Conteo por sexo pivotado (sin lambdas por grupo)
+    sex_ct = (filtered.groupby(["Country","Sex"], observed=True).size()
+              .unstack(fill_value=0)
+              .reindex(index=geo_df.index, columns=["F","M"], fill_value=0))
+    geo_df.insert(1, "atletas_mujeres", sex_ct["F"].to_numpy())
+    geo_df.insert(2, "atletas_hombres", sex_ct["M"].to_numpy())
+    return geo_df.reset_index().dropna(subset=["Country"])
+
+def bin_means(x, y, name, bins=12):
+    """Media de `y` en `bins` rangos de `x` con los mismos bordes que pd.cut(x, bins)."""
+    mn, mx = x.min(), x.max()
+    if mn == mx:
+        mn, mx = mn - (0.001*abs(mn) if mn != 0 else 0.001), mx + (0.001*abs(mx) if mx != 0 else 0.001)
+        edges = np.linspace(mn, mx, bins + 1)
+    else:
+        edges = np.linspace(mn, mx, bins + 1)
+        edges[0] -= (mx - mn) * 0.001
+    # Bins cerrados a la derecha (a, b], como pd.cut; suma / conteo con bincount
+    idx = np.searchsorted(edges, x, side="left") - 1
+    sums = np.bincount(idx, weights=y, minlength=bins)
+    counts = np.bincount(idx, minlength=bins)
+    means = np.divide(sums, counts, out=np.full(bins, np.nan), where=counts > 0)
+    return pd.DataFrame({"Peso_bin_mid": 0.5*(edges[1:] + edges[:-1]), name: means})
+
+@st.cache_data(ttl=3600, max_entries=CACHE_MAX_ENTRIES)
+def agg_bw_mean_line(key: FilterKey, lift, sex=None):
+    """Promedio de `lift` por rango de peso corporal (12 bins), de un sexo o de todos."""
+    bw_df = load_data(key, ["BodyweightKg", lift, "Sex"]).dropna()
+    if sex is not None:
+        bw_df = bw_df[eq_mask(bw_df["Sex"], sex)]
+    return bin_means(bw_df["BodyweightKg"].to_numpy(np.float64), bw_df[lift].to_numpy(np.float64), lift)
+
+
+# -----------------------------
+# Figuras cacheadas (JSON por filtro)
+# -----------------------------
+@st.cache_data(ttl=3600, max_entries=CACHE_MAX_ENTRIES)
+def fig_participation_json(key: FilterKey):
+    part = load_participation(key)
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    fig.add_trace(go.Bar(x=part["Year"], y=part["NameNormalized"],
+                         name="Atletas únicos", marker_color=CUSTOM_COLORS[0]),
+                  secondary_y=False)
+    fig.add_trace(go.Scatter(x=part["Year"], y=part["TotalKg"],
+                             name="Promedio Total (kg)", mode="lines+markers",
+                             line=dict(color=CUSTOM_COLORS[1], width=3)),
+                  secondary_y=True)
+    fig.update_yaxes(title_text="Atletas únicos", secondary_y=False)
+    fig.update_yaxes(title_text="Promedio Total (kg)", secondary_y=True)
+    fig.update_layout(DEFAULT_LAYOUT, title_text="Participación en el tiempo")
+    return fig.to_json()
+
+@st.cache_data(ttl=3600, max_entries=CACHE_MAX_ENTRIES)
+def fig_sex_evolution_json(key: FilterKey):
+    fig = px.line(load_sex_evolution(key), x="Year", y="Competencias", color="Sex",
+                  markers=True, color_discrete_map=SEX_COLORS)
+    fig.update_layout(DEFAULT_LAYOUT, title_text="Evolución por Genero")
+    return fig.to_json()
+
+@st.cache_data(ttl=3600, max_entries=CACHE_MAX_ENTRIES)
+def fig_lift_evolution_json(key: FilterKey, lift, title):
+    fig = px.line(
+        load_lift_evolution(key), x="Year", y=lift, color="Sex",
+        markers=True, color_discrete_map={**SEX_COLORS, "Promedio": "#f39c12"}
+    )
+    fig.update_layout(DEFAULT_LAYOUT, title_text=title, yaxis_title="kg")
+    return fig.to_json()
+
+@st.cache_data(ttl=3600, max_entries=CACHE_MAX_ENTRIES)
+def fig_sex_pie_json(key: FilterKey):
+    sex_counts = agg_counts(key, "Sex")
+    sex_counts.columns = ["Sexo","Atletas"]
+    fig = px.pie(sex_counts, values="Atletas", names="Sexo",
+                 color="Sexo", color_discrete_map=SEX_COLORS,
+                 hole=0.4, title="Distribución por sexo")
+    fig.update_layout(DEFAULT_LAYOUT)
+    return fig.to_json()
+
+@st.cache_data(ttl=3600, max_entries=CACHE_MAX_ENTRIES)
+def fig_equipment_pie_json(key: FilterKey):
+    eq_counts = agg_counts(key, "Equipment")
+    eq_counts.columns = ["Equipamiento","Atletas"]
+    fig = px.pie(eq_counts, values="Atletas", names="Equipamiento",
+                 hole=0.4, title="Distribución por equipamiento",
+                 color_discrete_sequence=CUSTOM_COLORS)
+    fig.update_layout(DEFAULT_LAYOUT)
+    return fig.to_json()
+
+@st.cache_data(ttl=3600, max_entries=CACHE_MAX_ENTRIES)
+def fig_geo_json(key: FilterKey, metric):
+    """Choropleth por país; None si no hay países."""
+    geo_df = agg_geo(key)
+    if geo_df.empty:
+        return None
+    fig = px.choropleth(
+        geo_df,
+        locations="Country",
+        locationmode="country names",
+        color=metric if metric in geo_df.columns else "promedio_total",
+        color_continuous_scale="Viridis",
+        projection="natural earth",
+        hover_data={
+            "atletas_totales": True,
+            "atletas_mujeres": True,
+            "atletas_hombres": True,
+            "promedio_total": ":.1f",
+            "promedio_squat": ":.1f",
+            "promedio_bench": ":.1f",
+            "promedio_deadlift": ":.1f",
+            "promedio_dots": ":.1f",
+            "promedio_edad": ":.1f"
+        },
+        title=f"Promedio de {metric} por País"
+    )
+    fig.update_layout(DEFAULT_LAYOUT)
+    return fig.to_json()
+
+@st.cache_data(ttl=3600, max_entries=CACHE_MAX_ENTRIES)
+def fig_age_box_json(key: FilterKey, lift):
+    """Box plot por categoría de edad; None si no hay datos."""
+    age_df = load_data(key, ["AgeClass", lift]).dropna()
+    if age_df.empty:
+        return None
+    fig = px.box(
+        age_df,
+        x="AgeClass",
+        y=lift,
+        color_discrete_sequence=CUSTOM_COLORS
+    )
+    fig.update_layout(DEFAULT_LAYOUT)
+    return fig.to_json()
+
+@st.cache_data(ttl=3600, max_entries=CACHE_MAX_ENTRIES)
+def fig_bw_json(key: FilterKey, lift):
+    """Rendimiento vs peso corporal con línea de promedio; None si no hay datos."""
+    bw_df = load_data(key, ["BodyweightKg", lift, "Sex"]).dropna()
+    if bw_df.empty:
+        return None
+    if len(bw_df) > SCATTER_MAX_POINTS:
+        # Demasiados puntos para el navegador: densidad 80x80 por sexo, binneada aquí
+        # (solo viajan los conteos) y con la línea de promedio de cada sexo en su panel
+        sexes = bw_df["Sex"].cat.remove_unused_categories().cat.categories.tolist()
+        x = bw_df["BodyweightKg"].to_numpy(np.float64)
+        y = bw_df[lift].to_numpy(np.float64)
+        x_edges = np.histogram_bin_edges(x, bins=80)
+        y_edges = np.histogram_bin_edges(y, bins=80)
+        fig = make_subplots(rows=1, cols=len(sexes), shared_yaxes=True,
+                            subplot_titles=[f"Sex={sx}" for sx in sexes])
+        for i, sx in enumerate(sexes, start=1):
+            mask = eq_mask(bw_df["Sex"], sx)
+            counts, _, _ = np.histogram2d(x[mask], y[mask], bins=[x_edges, y_edges])
+            fig.add_trace(go.Heatmap(x=0.5*(x_edges[1:] + x_edges[:-1]),
+                                     y=0.5*(y_edges[1:] + y_edges[:-1]),
+                                     z=counts.T.astype(np.int32), coloraxis="coloraxis", name=sx),
+                          row=1, col=i)
+            mean_line = agg_bw_mean_line(key, lift, sx)
+            fig.add_trace(go.Scatter(x=mean_line["Peso_bin_mid"], y=mean_line[lift],
+                                     mode="lines+markers", line=dict(color="gray", dash="dot"),
+                                     name="Promedio por rango", legendgroup="promedio",
+                                     showlegend=i == 1),
+                          row=1, col=i)
+            fig.update_xaxes(title_text="BodyweightKg", row=1, col=i)
+        fig.update_yaxes(title_text=lift, row=1, col=1)
+        fig.update_layout(coloraxis=dict(colorscale="Viridis", colorbar_title="count"))
+    else:
+        fig = px.scatter(
+            bw_df,
+            x="BodyweightKg",
+            y=lift,
+            color="Sex",
+            opacity=0.5,
+            color_discrete_map=SEX_COLORS,
+            render_mode="webgl"
+        )
+
+        # Línea de promedio por bins de peso
+        mean_line = agg_bw_mean_line(key, lift)
+
+        fig.add_scatter(
+            x=mean_line["Peso_bin_mid"],
+            y=mean_line[lift],
+            mode="lines+markers",
+            line=dict(color="gray", dash="dot"),
+            name="Promedio por rango"
+        )
+
+    fig.update_layout(DEFAULT_LAYOUT)
+    return fig.to_json()
+
+
+refresh_caches_if_stale()
+filter_options = load_filter_options()
+base = load_table(None)
+if filter_options is None or base.num_rows == 0:
     st.stop()
 
 # -----------------------------
 # Helpers analíticos
 # -----------------------------
 def col_ok(df, *cols):
-    return all(c in df.columns for c in cols)
+    return frozenset(cols).issubset(df.columns)
+
+def eq_mask(s, value):
+    """Máscara numpy de `s == value`; en categóricas compara códigos, no strings."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        cats = s.cat.categories
+        if value not in cats:
+            return np.zeros(len(s), dtype=bool)
+        return s.cat.codes.to_numpy() == cats.get_loc(value)
+    return s.to_numpy() == value
+
+@st.cache_data(ttl=3600, max_entries=CACHE_MAX_ENTRIES)
+def comparable_totals(sex, bw):
+    """Totales ordenados de atletas del mismo sexo con peso corporal en bw ± 5 kg."""
+    # Un solo predicado de Arrow: sin DataFrame intermedio ni máscaras por columna
+    expr = ((pc.field("Sex") == sex)
+            & (pc.field("BodyweightKg") >= bw - 5) & (pc.field("BodyweightKg") <= bw + 5)
+            & pc.field("TotalKg").is_valid())
+    totals = load_table(None).filter(expr)["TotalKg"].to_numpy()
+    return np.sort(totals)
 
 def score_col(df):
     for c in ["Dots","Wilks","Goodlift","Glossbrenner"]:
@@ -117,23 +591,72 @@ def score_col(df):
             return c
     return None
 
-def athlete_slice(df, name):
-    return df[df["NameNormalized"] == name].copy()
-
-def running_pr(series):
-    return series.cummax()
-
-def success_rate(row):
+@st.cache_resource(ttl=3600)
+def athlete_index():
+    """Tabla base + filas agrupadas por atleta (orden y offsets por código de NameNormalized).
+
+    Guarda la misma pa.Table de load_table(None) sobre la que se indexa: la lista de
+    atletas y las filas deben salir de aquí para que no se desfasen al refrescar.
+    """
+    tbl = load_table(None)
+    if tbl.num_rows == 0:
+        return tbl, np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64)
+    names = tbl["NameNormalized"].chunk(0)
+    codes = pc.fill_null(names.indices, -1).to_numpy().astype(np.int64)
+    order = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes[codes >= 0], minlength=len(names.dictionary))
+    offsets = np.concatenate([[0], np.cumsum(counts)]) + np.count_nonzero(codes < 0)
+    return tbl, order, offsets
+
+def athlete_slice(name):
+    """Filas de `name` como DataFrame; vacío si no está en el índice."""
+    tbl, order, offsets = athlete_index()
+    if tbl.num_rows == 0:
+        return pd.DataFrame()
+    i = pc.index(tbl["NameNormalized"].chunk(0).dictionary, name).as_py()
+    rows = order[offsets[i]:offsets[i + 1]] if i >= 0 else order[:0]
+    return tbl.take(rows).to_pandas(split_blocks=True, date_as_object=False)
+
+def to_days(dates):
+    """Fechas (Series o Timestamp) → días desde epoch como float64, sin bucles Python."""
+    return np.asarray(dates, dtype="datetime64[D]").astype(np.int64).astype(np.float64)
+
+def linear_fit(x, y):
+    """Recta de mínimos cuadrados en forma cerrada.
+
+    `y` puede ser (n,) o (n, k): cada columna se ajusta por separado ignorando sus NaN.
+    Devuelve (pendiente, intercepto) con la forma de las columnas de `y`.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    yk = y.reshape(len(x), -1)
+    w = ~np.isnan(yk)
+    n = w.sum(axis=0)
+    xk = np.where(w, x[:, None], 0.0)
+    # Columnas sin datos (p. ej. atletas solo de banca): medias NaN sin dividir por cero
+    xm = np.divide(xk.sum(axis=0), n, out=np.full(n.shape, np.nan), where=n > 0)
+    ym = np.divide(np.where(w, yk, 0.0).sum(axis=0), n, out=np.full(n.shape, np.nan), where=n > 0)
+    dx = np.where(w, xk - xm, 0.0)
+    dy = np.where(w, yk - ym, 0.0)
+    sxx = np.einsum("ij,ij->j", dx, dx)
+    sxy = np.einsum("ij,ij->j", dx, dy)
+    slope = np.divide(sxy, sxx, out=np.zeros_like(sxy), where=sxx > 0)
+    intercept = ym - slope * xm
+    return slope.reshape(y.shape[1:]), intercept.reshape(y.shape[1:])
+
+ATTEMPT_COLS = {
+    "Sentadilla":["Squat1Kg","Squat2Kg","Squat3Kg"],
+    "Banca":["Bench1Kg","Bench2Kg","Bench3Kg"],
+    "Peso Muerto":["Deadlift1Kg","Deadlift2Kg","Deadlift3Kg"],
+}
+
+def success_rate(df):
+    """% de intentos válidos (>0) por levantamiento para cada fila de `df` (ver load_attempts)."""
     out = {}
-    spec = {
-        "Sentadilla":["Squat1Kg","Squat2Kg","Squat3Kg"],
-        "Banca":["Bench1Kg","Bench2Kg","Bench3Kg"],
-        "Peso Muerto":["Deadlift1Kg","Deadlift2Kg","Deadlift3Kg"],
-    }
-    for lift, cols in spec.items():
-        hit = sum((c in row and pd.notna(row[c]) and float(row[c])>0) for c in cols)
-        out[lift] = round(100*hit/3,1)
-    return out
+    for lift, cols in ATTEMPT_COLS.items():
+        present = [c for c in cols if c in df.columns]
+        hits = (df[present].to_numpy(np.float32) > 0).sum(axis=1)
+        out[lift] = np.round(100*hits/3, 1)
+    return pd.DataFrame(out, index=df.index)
 
 def last_meet_rows(adf):
     if not col_ok(adf,"Date"): return None, None
@@ -144,7 +667,7 @@ def my_category_mask(df, row):
     mask = pd.Series(True, index=df.index)
     for c in ["Sex","Equipment","AgeClass","WeightClass"]:
         if c in df.columns and c in row and pd.notna(row[c]):
-            mask &= (df[c].astype(str) == str(row[c]))
+            mask &= eq_mask(df[c], row[c])
     return mask
 
 # -----------------------------
@@ -153,6 +676,37 @@ def my_category_mask(df, row):
 st.markdown('<h1 style="text-align:center; color:#8c8cff;">Powerlifting Analytics Dashboard</h1>', unsafe_allow_html=True)
 st.markdown("---")
 
+# -----------------------------
+# Filtros en sidebar
+# -----------------------------
+st.sidebar.header("⚙️ Configurar Filtros")
+
+sex_filter = st.sidebar.selectbox("Sexo", ["Todos"] + filter_options["Sex"])
+equip_filter = st.sidebar.selectbox("Equipamiento", ["Todos"] + filter_options["Equipment"])
+country_filter = st.sidebar.selectbox("País", ["Todos"] + filter_options["Country"])
+year_min, year_max = filter_options["year"]
+year_range = st.sidebar.slider("Rango de años", year_min, year_max, (year_min, year_max))
+age_filter = st.sidebar.selectbox("Categoría de edad", ["Todos"] + filter_options["AgeClass"])
+total_min, total_max = filter_options["total"]
+total_range = st.sidebar.slider("Rango de Totales (kg)", total_min, total_max, (total_min, total_max))
+
+# -----------------------------
+# Info dataset en sidebar
+# -----------------------------
+st.sidebar.markdown("---")
+st.sidebar.subheader("📊 Estado del Dataset")
+
+total_registros = base.num_rows          # total cargado (muestra o full)
+st.sidebar.write(f"Usando **{format_count(total_registros)}** registros de {TOTAL_ORIGINAL_FMT}")
+st.sidebar.progress(min(total_registros / TOTAL_ORIGINAL, 1.0))
+
+# -----------------------------
+# Aplicar filtros (en BigQuery)
+# -----------------------------
+filter_key = make_filter_key(sex_filter, equip_filter, country_filter, age_filter, year_range, total_range)
+filtered = load_table(filter_key)
+filtered_cols = frozenset(filtered.column_names)
+
 # -----------------------------
 # Tabs
 # -----------------------------
@@ -170,51 +724,7 @@ tab1, tab2, tab3, tab4, tab5 = st.tabs([
 with tab1:
     st.subheader("ℹ️ Información General")
 
-    # -----------------------------
-    # Filtros en sidebar
-    # -----------------------------
-    st.sidebar.header("⚙️ Configurar Filtros")
-
-    sex_filter = st.sidebar.selectbox("Sexo", ["Todos"] + sorted(df["Sex"].dropna().unique().tolist()))
-    equip_filter = st.sidebar.selectbox("Equipamiento", ["Todos"] + sorted(df["Equipment"].dropna().unique().tolist()))
-    country_filter = st.sidebar.selectbox("País", ["Todos"] + sorted(df["Country"].dropna().unique().tolist()))
-    year_min, year_max = int(df["Year"].min()), int(df["Year"].max())
-    year_range = st.sidebar.slider("Rango de años", year_min, year_max, (year_min, year_max))
-    age_filter = st.sidebar.selectbox("Categoría de edad", ["Todos"] + sorted(df["AgeClass"].dropna().unique().tolist()))
-    total_min, total_max = float(df["TotalKg"].min()), float(df["TotalKg"].max())
-    total_range = st.sidebar.slider("Rango de Totales (kg)", total_min, total_max, (total_min, total_max))
-
-    # -----------------------------
-    # Info dataset en sidebar
-    # -----------------------------
-    st.sidebar.markdown("---")
-    st.sidebar.subheader("📊 Estado del Dataset")
-
-    total_registros = len(df)          # total cargado (muestra o full)
-    total_original = 2463024           # ⚠️ ajustar al total real de BigQuery
-    st.sidebar.write(f"Usando **{format_count(total_registros)}** registros de {format_count(total_original)}")
-    st.sidebar.progress(total_registros / total_original)
-
-    # -----------------------------
-    # Aplicar filtros
-    # -----------------------------
-    filtered = df.copy()
-    if sex_filter != "Todos":
-        filtered = filtered[filtered["Sex"] == sex_filter]
-    if equip_filter != "Todos":
-        filtered = filtered[filtered["Equipment"] == equip_filter]
-    if country_filter != "Todos":
-        filtered = filtered[filtered["Country"] == country_filter]
-    if age_filter != "Todos":
-        filtered = filtered[filtered["AgeClass"] == age_filter]
-    filtered = filtered[
-        (filtered["Year"] >= year_range[0]) & 
-        (filtered["Year"] <= year_range[1]) &
-        (filtered["TotalKg"] >= total_range[0]) & 
-        (filtered["TotalKg"] <= total_range[1])
-    ]
-
-    if filtered.empty:
+    if filtered.num_rows == 0:
         st.warning("⚠️ No hay datos con los filtros seleccionados.")
     else:
         # Layout en dos columnas
@@ -225,33 +735,14 @@ with tab1:
         # -----------------------------
         with col1:
             st.markdown("### 📊 Participación en el tiempo")
-            part = filtered.groupby("Year").agg({
-                "NameNormalized":"nunique",
-                "TotalKg":"mean"
-            }).reset_index()
-            fig1 = make_subplots(specs=[[{"secondary_y": True}]])
-            fig1.add_trace(go.Bar(x=part["Year"], y=part["NameNormalized"],
-                                  name="Atletas únicos", marker_color=CUSTOM_COLORS[0]),
-                           secondary_y=False)
-            fig1.add_trace(go.Scatter(x=part["Year"], y=part["TotalKg"],
-                                      name="Promedio Total (kg)", mode="lines+markers",
-                                      line=dict(color=CUSTOM_COLORS[1], width=3)),
-                           secondary_y=True)
-            fig1.update_yaxes(title_text="Atletas únicos", secondary_y=False)
-            fig1.update_yaxes(title_text="Promedio Total (kg)", secondary_y=True)
-            fig1.update_layout(title="Participación en el tiempo", **DEFAULT_LAYOUT)
-            st.plotly_chart(fig1, use_container_width=True)
+            st.plotly_chart(json.loads(fig_participation_json(filter_key)), use_container_width=True)
 
         # -----------------------------
         # Gráfico 2: Evolución hombres vs mujeres
         # -----------------------------
         with col2:
             st.markdown("### 👥 Evolución de hombres y mujeres")
-            sex_evol = filtered.groupby(["Year","Sex"]).size().reset_index(name="Competencias")
-            fig2 = px.line(sex_evol, x="Year", y="Competencias", color="Sex", markers=True,
-                           color_discrete_map=SEX_COLORS)
-            fig2.update_layout(title="Evolución por Genero", **DEFAULT_LAYOUT)
-            st.plotly_chart(fig2, use_container_width=True)
+            st.plotly_chart(json.loads(fig_sex_evolution_json(filter_key)), use_container_width=True)
 
 
         # -----------------------------
@@ -263,52 +754,19 @@ with tab1:
 
         # Squat
         with colA:
-            # Squat promedio por año y sexo
-            squat_evol = filtered.groupby(["Year","Sex"])["Best3SquatKg"].mean().reset_index()
-
-            # Squat promedio general por año (M+F juntos)
-            squat_avg = filtered.groupby("Year")["Best3SquatKg"].mean().reset_index()
-            squat_avg["Sex"] = "Promedio"
-
-            # Unir ambos
-            squat_all = pd.concat([squat_evol, squat_avg], ignore_index=True)
-
-            # Gráfico
-            fig_squat = px.line(
-                squat_all, x="Year", y="Best3SquatKg", color="Sex",
-                markers=True, color_discrete_map={**SEX_COLORS, "Promedio": "#f39c12"}
-            )
-            fig_squat.update_layout(title="Squat", yaxis_title="kg", **DEFAULT_LAYOUT)
-            st.plotly_chart(fig_squat, use_container_width=True)
+            st.plotly_chart(json.loads(fig_lift_evolution_json(filter_key, "Best3SquatKg", "Squat")),
+                            use_container_width=True)
 
 
         # Bench
         with colB:
-            bench_evol = filtered.groupby(["Year","Sex"])["Best3BenchKg"].mean().reset_index()
-            bench_avg = filtered.groupby("Year")["Best3BenchKg"].mean().reset_index()
-            bench_avg["Sex"] = "Promedio"
-            bench_all = pd.concat([bench_evol, bench_avg], ignore_index=True)
-
-            fig_bench = px.line(
-                bench_all, x="Year", y="Best3BenchKg", color="Sex",
-                markers=True, color_discrete_map={**SEX_COLORS, "Promedio": "#f39c12"}
-            )
-            fig_bench.update_layout(title="Bench", yaxis_title="kg", **DEFAULT_LAYOUT)
-            st.plotly_chart(fig_bench, use_container_width=True)
+            st.plotly_chart(json.loads(fig_lift_evolution_json(filter_key, "Best3BenchKg", "Bench")),
+                            use_container_width=True)
 
         # Deadlift
         with colC:
-            dl_evol = filtered.groupby(["Year","Sex"])["Best3DeadliftKg"].mean().reset_index()
-            dl_avg = filtered.groupby("Year")["Best3DeadliftKg"].mean().reset_index()
-            dl_avg["Sex"] = "Promedio"
-            dl_all = pd.concat([dl_evol, dl_avg], ignore_index=True)
-
-            fig_dl = px.line(
-                dl_all, x="Year", y="Best3DeadliftKg", color="Sex",
-                markers=True, color_discrete_map={**SEX_COLORS, "Promedio": "#f39c12"}
-            )
-            fig_dl.update_layout(title="Deadlift", yaxis_title="kg", **DEFAULT_LAYOUT)
-            st.plotly_chart(fig_dl, use_container_width=True)
+            st.plotly_chart(json.loads(fig_lift_evolution_json(filter_key, "Best3DeadliftKg", "Deadlift")),
+                            use_container_width=True)
 
         # -----------------------------
         # Gráficos circulares de distribución
@@ -318,24 +776,12 @@ with tab1:
         col_p1, col_p2 = st.columns(2)
 
         with col_p1:
-            if "Sex" in filtered.columns:
-                sex_counts = filtered["Sex"].value_counts().reset_index()
-                sex_counts.columns = ["Sexo","Atletas"]
-                fig_pie1 = px.pie(sex_counts, values="Atletas", names="Sexo",
-                                  color="Sexo", color_discrete_map=SEX_COLORS,
-                                  hole=0.4, title="Distribución por sexo")
-                fig_pie1.update_layout(**DEFAULT_LAYOUT)
-                st.plotly_chart(fig_pie1, use_container_width=True)
+            if "Sex" in filtered_cols:
+                st.plotly_chart(json.loads(fig_sex_pie_json(filter_key)), use_container_width=True)
 
         with col_p2:
-            if "Equipment" in filtered.columns:
-                eq_counts = filtered["Equipment"].value_counts().reset_index()
-                eq_counts.columns = ["Equipamiento","Atletas"]
-                fig_pie2 = px.pie(eq_counts, values="Atletas", names="Equipamiento",
-                                  hole=0.4, title="Distribución por equipamiento",
-                                  color_discrete_sequence=CUSTOM_COLORS)
-                fig_pie2.update_layout(**DEFAULT_LAYOUT)
-                st.plotly_chart(fig_pie2, use_container_width=True)
+            if "Equipment" in filtered_cols:
+                st.plotly_chart(json.loads(fig_equipment_pie_json(filter_key)), use_container_width=True)
 # Fin tab1
 
 # -----------------------------
@@ -344,7 +790,7 @@ with tab1:
 with tab2:
     st.subheader("🌍 Análisis Geográfico")
 
-    if filtered.empty:
+    if filtered.num_rows == 0:
         st.warning("⚠️ No hay datos con los filtros seleccionados.")
     else:
         # Selector de métrica
@@ -354,47 +800,13 @@ with tab2:
             index=0
         )
 
-        # Agregación por país
-        geo_df = filtered.groupby("Country").agg(
-            atletas_totales=("NameNormalized","nunique"),
-            atletas_mujeres=("Sex", lambda x: (x=="F").sum()),
-            atletas_hombres=("Sex", lambda x: (x=="M").sum()),
-            promedio_total=("TotalKg","mean"),
-            promedio_squat=("Best3SquatKg","mean"),
-            promedio_bench=("Best3BenchKg","mean"),
-            promedio_deadlift=("Best3DeadliftKg","mean"),
-            promedio_dots=("Dots","mean"),
-            promedio_edad=("AgeClass", lambda x: pd.to_numeric(x, errors="coerce").mean())
-        ).reset_index()
-
-        geo_df = geo_df.dropna(subset=["Country"])
+        # Agregación por país + mapa con hover enriquecido
+        fig_map = fig_geo_json(filter_key, metric_option)
 
-        if geo_df.empty:
+        if fig_map is None:
             st.warning("⚠️ No hay datos de países con esta métrica.")
         else:
-            # Mapa con hover enriquecido
-            fig_map = px.choropleth(
-                geo_df,
-                locations="Country",
-                locationmode="country names",
-                color=metric_option if metric_option in geo_df.columns else "promedio_total",
-                color_continuous_scale="Viridis",
-                projection="natural earth",
-                hover_data={
-                    "atletas_totales": True,
-                    "atletas_mujeres": True,
-                    "atletas_hombres": True,
-                    "promedio_total": ":.1f",
-                    "promedio_squat": ":.1f",
-                    "promedio_bench": ":.1f",
-                    "promedio_deadlift": ":.1f",
-                    "promedio_dots": ":.1f",
-                    "promedio_edad": ":.1f"
-                },
-                title=f"Promedio de {metric_option} por País"
-            )
-            fig_map.update_layout(**DEFAULT_LAYOUT)
-            st.plotly_chart(fig_map, use_container_width=True)
+            st.plotly_chart(json.loads(fig_map), use_container_width=True)
 
 
 # -----------------------------
@@ -403,28 +815,6 @@ with tab2:
 with tab3:
     st.subheader("📊 Análisis por Categorías")
 
-    # Aplicar filtros globales
-    filtered_df = df.copy()
-
-    if sex_filter != "Todos":
-        filtered_df = filtered_df[filtered_df["Sex"] == sex_filter]
-    if equip_filter != "Todos":
-        filtered_df = filtered_df[filtered_df["Equipment"] == equip_filter]
-    if country_filter != "Todos":
-        filtered_df = filtered_df[filtered_df["Country"] == country_filter]
-    if age_filter != "Todos":
-        filtered_df = filtered_df[filtered_df["AgeClass"] == age_filter]
-
-    filtered_df = filtered_df[
-        (filtered_df["Year"] >= year_range[0]) &
-        (filtered_df["Year"] <= year_range[1])
-    ]
-
-    filtered_df = filtered_df[
-        (filtered_df["TotalKg"] >= total_range[0]) &
-        (filtered_df["TotalKg"] <= total_range[1])
-    ]
-
     # Selección de movimiento global para esta pestaña
     lift_option = st.selectbox(
         "Selecciona el movimiento",
@@ -441,17 +831,10 @@ with tab3:
     with col1:
         st.markdown("### ⏳ Rendimiento por Categoría de Edad")
 
-        if "AgeClass" in filtered_df.columns:
-            age_df = filtered_df[["AgeClass", lift_option]].dropna()
-            if not age_df.empty:
-                fig_age = px.box(
-                    age_df,
-                    x="AgeClass",
-                    y=lift_option,
-                    color_discrete_sequence=CUSTOM_COLORS
-                )
-                fig_age.update_layout(**DEFAULT_LAYOUT)
-                st.plotly_chart(fig_age, use_container_width=True)
+        if "AgeClass" in filtered_cols:
+            fig_age = fig_age_box_json(filter_key, lift_option)
+            if fig_age is not None:
+                st.plotly_chart(json.loads(fig_age), use_container_width=True)
             else:
                 st.warning("⚠️ No hay datos suficientes para categorías de edad.")
 
@@ -461,33 +844,10 @@ with tab3:
     with col2:
         st.markdown("### ⚖️ Rendimiento según Peso Corporal")
 
-        if "BodyweightKg" in filtered_df.columns:
-            bw_df = filtered_df[["BodyweightKg", lift_option, "Sex"]].dropna()
-            if not bw_df.empty:
-                fig_bw = px.scatter(
-                    bw_df,
-                    x="BodyweightKg",
-                    y=lift_option,
-                    color="Sex",
-                    opacity=0.5,
-                    color_discrete_map=SEX_COLORS
-                )
-
-                # Línea de promedio por bins de peso
-                bw_df["Peso_bin"] = pd.cut(bw_df["BodyweightKg"], bins=12)
-                mean_line = bw_df.groupby("Peso_bin")[lift_option].mean().reset_index()
-                mean_line["Peso_bin_mid"] = mean_line["Peso_bin"].apply(lambda x: x.mid)
-
-                fig_bw.add_scatter(
-                    x=mean_line["Peso_bin_mid"],
-                    y=mean_line[lift_option],
-                    mode="lines+markers",
-                    line=dict(color="gray", dash="dot"),
-                    name="Promedio por rango"
-                )
-
-                fig_bw.update_layout(**DEFAULT_LAYOUT)
-                st.plotly_chart(fig_bw, use_container_width=True)
+        if "BodyweightKg" in filtered_cols:
+            fig_bw = fig_bw_json(filter_key, lift_option)
+            if fig_bw is not None:
+                st.plotly_chart(json.loads(fig_bw), use_container_width=True)
             else:
                 st.warning("⚠️ No hay datos suficientes para categorías de peso corporal.")
 
@@ -497,39 +857,46 @@ with tab3:
 with tab4:
     st.subheader("📑 Ficha del Atleta")
 
+    # Lista, rango de años y filas salen de la misma tabla indexada
+    athlete_tbl = athlete_index()[0]
+
     # Filtro de años (independiente del sidebar)
-    year_min, year_max = int(df["Year"].min()), int(df["Year"].max())
+    years_mm = pc.min_max(athlete_tbl["Year"])
+    year_min, year_max = years_mm["min"].as_py(), years_mm["max"].as_py()
     year_range = st.slider("Rango de años", year_min, year_max, (year_min, year_max), key="year_ficha")
 
-    # Lista de atletas
-    athletes = sorted(df["NameNormalized"].dropna().unique().tolist())
+    # Lista de atletas (categorías ya únicas y ordenadas)
+    athletes = table_categories(athlete_tbl, "NameNormalized")
     who = st.selectbox("Selecciona un atleta", athletes, index=0, key="ficha_atleta")
 
-    me = df[(df["NameNormalized"] == who) &
-            (df["Year"] >= year_range[0]) &
-            (df["Year"] <= year_range[1])].copy()
+    me = athlete_slice(who)
+    years = me["Year"].to_numpy()
+    me = me[(years >= year_range[0]) & (years <= year_range[1])]
 
     if me.empty:
         st.warning("⚠️ No hay datos para este atleta en el rango seleccionado.")
     else:
         # Info básica
         nombre = who
-        pais = me["Country"].mode().iloc[0] if "Country" in me.columns else "Desconocido"
+        country_counts = me["Country"].value_counts() if "Country" in me.columns else pd.Series(dtype=int)
+        pais = country_counts.index[0] if len(country_counts) and country_counts.iloc[0] > 0 else "Desconocido"
         st.markdown(f"### 👤 {nombre}")
         st.markdown(f"**País:** {pais}")
 
         # -----------------------------
         # Tarjetas de PRs
         # -----------------------------
+        # Un solo max sobre las cuatro columnas
+        prs = me[LIFT_COLS].max()
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("PR Squat", f"{me['Best3SquatKg'].max():.1f} kg")
+            st.metric("PR Squat", f"{prs['Best3SquatKg']:.1f} kg")
         with col2:
-            st.metric("PR Bench", f"{me['Best3BenchKg'].max():.1f} kg")
+            st.metric("PR Bench", f"{prs['Best3BenchKg']:.1f} kg")
         with col3:
-            st.metric("PR Deadlift", f"{me['Best3DeadliftKg'].max():.1f} kg")
+            st.metric("PR Deadlift", f"{prs['Best3DeadliftKg']:.1f} kg")
         with col4:
-            st.metric("Mejor Total", f"{me['TotalKg'].max():.1f} kg")
+            st.metric("Mejor Total", f"{prs['TotalKg']:.1f} kg")
 
         # -----------------------------
         # Evolución anual de cada movimiento con proyección
@@ -546,21 +913,20 @@ with tab4:
             # proyección lineal
             d = me[["Date", col]].dropna()
             if len(d) >= 3:
-                x = d["Date"].map(datetime.toordinal)
-                y = d[col].astype(float)
-                coef = np.polyfit(x, y, 1)
-                fut = d["Date"].max() + pd.DateOffset(months=6)
-                y_fut = coef[0]*fut.toordinal() + coef[1]
+                slope, intercept = linear_fit(to_days(d["Date"]), d[col].to_numpy(np.float64))
+                last = d["Date"].max()
+                fut = last + pd.DateOffset(months=6)
+                y_fut = slope*to_days(fut) + intercept
 
                 fig.add_scatter(
-                    x=[d["Date"].max().year, fut.year],
+                    x=[last.year, fut.year],
                     y=[d[col].iloc[-1], y_fut],
                     mode="lines+markers",
                     line=dict(color="gray", dash="dash"),
                     name="Proyección 6m"
                 )
 
-            fig.update_layout(**DEFAULT_LAYOUT)
+            fig.update_layout(DEFAULT_LAYOUT)
             return fig
 
         with colA:
@@ -580,7 +946,7 @@ with tab4:
         # -----------------------------
         st.markdown("### 📋 Competencias del Atleta")
         cols = ["Year","AgeClass","Best3SquatKg","Best3BenchKg","Best3DeadliftKg","TotalKg"]
-        table = me[cols].sort_values("Year", ascending=False)
+        table = me[cols].sort_values("Year", ascending=False).head(ATHLETE_TABLE_MAX_ROWS)
         table = table.rename(columns={
             "Year": "Año",
             "AgeClass": "Categoría Edad",
@@ -588,33 +954,51 @@ with tab4:
             "Best3BenchKg": "Bench (kg)",
             "Best3DeadliftKg": "Deadlift (kg)",
             "TotalKg": "Total (kg)"
-        })
-        st.dataframe(table, use_container_width=True)
+        }).convert_dtypes(dtype_backend="pyarrow")
+        kg_col = st.column_config.NumberColumn(format="%.1f")
+        st.dataframe(
+            table,
+            column_config={
+                "Año": st.column_config.NumberColumn(format="%d"),
+                "Squat (kg)": kg_col,
+                "Bench (kg)": kg_col,
+                "Deadlift (kg)": kg_col,
+                "Total (kg)": kg_col,
+            },
+            hide_index=True,
+            use_container_width=True
+        )
 
         # -----------------------------
         # Proyección a 6 meses (barras comparativas)
         # -----------------------------
         proj = []
         if "Date" in me.columns:
-            for lift, col in [("Squat","Best3SquatKg"),
-                              ("Bench","Best3BenchKg"),
-                              ("Deadlift","Best3DeadliftKg"),
-                              ("Total","TotalKg")]:
-                d = me[["Date",col]].dropna()
-                if len(d) >= 3:
-                    x = d["Date"].map(datetime.toordinal)
-                    y = d[col].astype(float)
-                    coef = np.polyfit(x,y,1)
-                    fut = d["Date"].max() + pd.DateOffset(months=6)
-                    y_fut = coef[0]*fut.toordinal() + coef[1]
-                    proj.append([lift, d[col].max(), max(y_fut, d[col].max())])
+            proj_lifts = [("Squat","Best3SquatKg"),
+                          ("Bench","Best3BenchKg"),
+                          ("Deadlift","Best3DeadliftKg"),
+                          ("Total","TotalKg")]
+            d = me[me["Date"].notna()]
+            # Con menos de 3 competencias fechadas ningún levantamiento se proyecta: no se ajusta nada
+            if len(d) >= 3:
+                Y = d[[col for _, col in proj_lifts]].to_numpy(np.float64)
+                valid = ~np.isnan(Y)
+                n_valid = valid.sum(axis=0)
+                # Los cuatro ajustes en una sola pasada vectorizada
+                slopes, intercepts = linear_fit(to_days(d["Date"]), Y)
+                for j, (lift, col) in enumerate(proj_lifts):
+                    if n_valid[j] >= 3:
+                        fut = d["Date"][valid[:, j]].max() + pd.DateOffset(months=6)
+                        y_fut = slopes[j]*to_days(fut) + intercepts[j]
+                        pr = d[col].max()
+                        proj.append([lift, pr, max(y_fut, pr)])
 
         if proj:
             pdf = pd.DataFrame(proj, columns=["Levantamiento","PR actual","Proyección 6m"])
             st.markdown("### 🔮 Proyección de Rendimiento a 6 meses")
             fig_proj = px.bar(pdf, x="Levantamiento", y=["PR actual","Proyección 6m"], barmode="group",
                               color_discrete_sequence=CUSTOM_COLORS)
-            fig_proj.update_layout(**DEFAULT_LAYOUT)
+            fig_proj.update_layout(DEFAULT_LAYOUT)
             st.plotly_chart(fig_proj, use_container_width=True)
             st.dataframe(pdf, hide_index=True, use_container_width=True)
 
@@ -631,8 +1015,8 @@ with tab5:
     col1, col2, col3 = st.columns(3)
     with col1:
         sex_in = st.selectbox("Sexo", ["M", "F"])
-        equip_in = st.selectbox("Equipamiento", df["Equipment"].dropna().unique())
-        country_in = st.selectbox("País", ["Todos"] + sorted(df["Country"].dropna().unique()))
+        equip_in = st.selectbox("Equipamiento", table_categories(base, "Equipment"))
+        country_in = st.selectbox("País", ["Todos"] + table_categories(base, "Country"))
     with col2:
         age_in = st.number_input("Edad", 15, 90, 25)
         bw_in = st.number_input("Peso corporal (kg)", 30.0, 200.0, 80.0, step=0.5)
@@ -647,23 +1031,24 @@ with tab5:
     # =========================
     # Filtrar dataset comparable
     # =========================
-    comp_df = df.copy()
-    comp_df = comp_df[(comp_df["Sex"] == sex_in)]
-    comp_df = comp_df[(comp_df["BodyweightKg"].between(bw_in - 5, bw_in + 5))]
-    comp_df = comp_df.dropna(subset=["TotalKg"])
+    # Ordenado y cacheado por (sexo, peso): cambiar las marcas solo hace búsquedas binarias
+    comp_totals = comparable_totals(sex_in, bw_in)
 
-    if not comp_df.empty:
+    if len(comp_totals):
         # Calcular percentil
-        rank = (comp_df["TotalKg"] < total_in).sum()
-        percentil = rank / len(comp_df) * 100
+        rank = np.searchsorted(comp_totals, total_in, side="left")
+        percentil = rank / len(comp_totals) * 100
 
         # Atleta superior más cercano
-        superior = comp_df[comp_df["TotalKg"] > total_in].sort_values("TotalKg").head(1)
+        i_sup = np.searchsorted(comp_totals, total_in, side="right")
+        superior = comp_totals[i_sup] if i_sup < len(comp_totals) else None
 
-        st.markdown(f"📊 Estás en el **percentil {percentil:.1f}%** de tu categoría.")
-        if not superior.empty:
-            falta = superior["TotalKg"].iloc[0] - total_in
-            st.markdown(f"⬆️ Te faltan **{falta:.1f} kg** para alcanzar al siguiente atleta en tu categoría.")
+        # Un solo bloque markdown para el resumen (un elemento menos que serializar)
+        resumen = [f"📊 Estás en el **percentil {percentil:.1f}%** de tu categoría."]
+        if superior is not None:
+            falta = superior - total_in
+            resumen.append(f"⬆️ Te faltan **{falta:.1f} kg** para alcanzar al siguiente atleta en tu categoría.")
+        st.markdown("\n\n".join(resumen))
 
         # =========================
         # Gauge (percentil)
@@ -688,7 +1073,7 @@ with tab5:
         ))
 
         # 🔑 Quitar título "undefined"
-        fig_g.update_layout(title=None, **DEFAULT_LAYOUT)
+        fig_g.update_layout(DEFAULT_LAYOUT, title_text=None)
 
         st.plotly_chart(fig_g, use_container_width=True)
 
@@ -700,31 +1085,33 @@ with tab5:
         st.info("Este gráfico muestra cómo se distribuyen los Totales de todos los atletas en tu categoría. "
                 "La línea roja indica tu posición actual.")
 
-        fig_hist = px.histogram(comp_df, x="TotalKg", nbins=30,
-                                color_discrete_sequence=CUSTOM_COLORS,
-                                title="Distribución de Totales (kg)")
+        # Binning en el servidor: al navegador solo viajan 30 barras, no todos los totales
+        counts, edges = np.histogram(comp_totals, bins=30)
+        fig_hist = go.Figure(go.Bar(x=0.5*(edges[1:] + edges[:-1]), y=counts, width=np.diff(edges),
+                                    marker_color=CUSTOM_COLORS[0], name="Atletas"))
+        fig_hist.update_layout(title="Distribución de Totales (kg)", xaxis_title="TotalKg",
+                               yaxis_title="count", bargap=0)
         fig_hist.add_vline(x=total_in, line_dash="dash", line_color="red",
                            annotation_text="Tu Total", annotation_position="top")
-        fig_hist.update_layout(**DEFAULT_LAYOUT)
+        fig_hist.update_layout(DEFAULT_LAYOUT)
         st.plotly_chart(fig_hist, use_container_width=True)
 
         # =========================
         # Comparativa de Totales
         # =========================
-        if not superior.empty:
+        if superior is not None:
             st.markdown("### 🏋️ Comparativa de Rendimiento")
             st.info("Comparamos tu Total con el **promedio de tu categoría** y con el **atleta superior más cercano**.")
 
             comp_vals = {
                 "Tú": total_in,
-                "Promedio Cat": comp_df["TotalKg"].mean(),
-                "Superior cercano": superior["TotalKg"].iloc[0]
+                "Promedio Cat": comp_totals.mean(),
+                "Superior cercano": superior
             }
-            fig_bar = px.bar(x=list(comp_vals.keys()), y=list(comp_vals.values()),
-                             color=list(comp_vals.keys()),
-                             color_discrete_sequence=CUSTOM_COLORS,
-                             title="Comparativa de Totales (kg)")
-            fig_bar.update_layout(**DEFAULT_LAYOUT)
+            # Una sola traza con color por barra (en vez de una traza por categoría)
+            fig_bar = go.Figure(go.Bar(x=list(comp_vals.keys()), y=list(comp_vals.values()),
+                                       marker_color=CUSTOM_COLORS[:len(comp_vals)]))
+            fig_bar.update_layout(DEFAULT_LAYOUT, title_text="Comparativa de Totales (kg)")
             st.plotly_chart(fig_bar, use_container_width=True)
 
     else:
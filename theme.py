@@ -1,17 +1,22 @@
 # theme.py
+from types import MappingProxyType
+
+import plotly.graph_objects as go
 
 # 🎨 Paleta personalizada
 CUSTOM_COLORS = ["#C6D92D", "#00C2C7", "#6E6E6E", "#2B2B2B"]
 
-# 🎨 Colores por categoría fija (ejemplo atletas M/F)
-SEX_COLORS = {
+# 🎨 Colores por categoría fija (ejemplo atletas M/F), de solo lectura
+SEX_COLORS = MappingProxyType({
     "M": "#00C2C7",   # Turquesa
     "F": "#C6D92D"    # Verde lima
-}
+})
 
-# 🎨 Estilo global Plotly
-DEFAULT_LAYOUT = dict(
-    plot_bgcolor="#2B2B2B", 
+# 🎨 Estilo global Plotly: validado una vez al importar.
+# Uso: fig.update_layout(DEFAULT_LAYOUT, title_text=...). Con title=... se reemplaza
+# el objeto title completo y se pierde el title_font del tema.
+DEFAULT_LAYOUT = go.Layout(
+    plot_bgcolor="#2B2B2B",
     paper_bgcolor="#121212",
     font=dict(color="#EAEAEA"),
     title_font=dict(size=18, color="#C6D92D"),